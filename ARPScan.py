@@ -1,25 +1,28 @@
 #!/usr/bin/env python
 
-import sys
 import logging
 logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
-from scapy.all import *
+from SweepMetrics import sweep_metrics
 
 
 class ARPScan(object):
     def __init__(self):
         self.ip_range = "192.168.0.1/24"
         self.connect_devices = []
+        self.mac_addresses = {}
 
     def scan(self):
-        alive, dead = srp(Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=self.ip_range), timeout=2, verbose=0)
+        # scapy takes longer to import than the rest of the program put together, so only pay for it when scanning
+        from scapy.all import srp, Ether, ARP
+
+        with sweep_metrics.phase("arp_scan"):
+            alive, dead = srp(Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=self.ip_range), timeout=2, verbose=0)
 
         try:
             for i in range(0, len(alive)):
                 self.connect_devices.append(alive[i][1].psrc)
+                self.mac_addresses[alive[i][1].psrc] = alive[i][1].hwsrc
         except:
             return None
 
         return self.connect_devices
-
-scan = ARPScan()
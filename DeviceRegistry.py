@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import csv
+import datetime
+import fcntl
+import os
+from contextlib import contextmanager
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+REGISTRY_FIELDS = ["Device ID", "MAC Address", "IP Address", "First Seen", "Last Seen", "IPv6 Address"]
+
+
+class Device(object):
+    def __init__(self, device_id: int, mac_address: str, ip_address: str, first_seen: str, last_seen: str,
+                 ipv6_address: str = ""):
+        self.device_id = device_id
+        self.mac_address = mac_address
+        self.ip_address = ip_address
+        self.ipv6_address = ipv6_address
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+
+
+class DeviceRegistry(object):
+    """Devices seen on the network, keyed by MAC address so a device keeps its id when DHCP moves it.
+    A dual-stack device has one entry, holding both its IPv4 and IPv6 address.
+
+    Device ids are small integers handed out in the order devices are first seen, and are also the index of the
+    device in self.devices, so looking a device up by id is a list index.
+    """
+
+    def __init__(self, registry_file: str = os.path.join(DATA_DIRECTORY, 'devices.csv')):
+        self.registry_file = registry_file
+        self.devices = []
+        self.by_mac = {}
+        self.by_ip = {}
+
+    def load(self):
+        """Reads the registry from disk, replacing what is in memory. A missing file is an empty registry."""
+        self.devices = []
+        self.by_mac = {}
+        self.by_ip = {}
+        if not os.path.isfile(self.registry_file):
+            return self
+
+        with open(self.registry_file) as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                device = Device(int(row['Device ID']), row['MAC Address'], row['IP Address'],
+                                row['First Seen'], row['Last Seen'], row.get('IPv6 Address') or "")
+                self._index(device)
+
+        # An address may have been reassigned since a device was last seen, in which case the newest owner wins
+        for device in self.devices:
+            for address in (device.ip_address, device.ipv6_address):
+                if address and device.last_seen > self.by_ip[address].last_seen:
+                    self.by_ip[address] = device
+
+        return self
+
+    @contextmanager
+    def update(self):
+        """Rereads the registry and saves it afterwards, holding a lock throughout.
+
+        Cron runs can overlap, and without the lock two runs that each find a new device would both hand out the
+        next id. The lock is on a separate file, as save() replaces the registry file itself.
+        """
+        with open(self.registry_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield self
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        # Written to a temporary file first, so a crash mid-write never leaves a truncated registry behind
+        temporary_file = self.registry_file + '.tmp'
+        with open(temporary_file, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file, delimiter=',')
+            writer.writerow(REGISTRY_FIELDS)
+            for device in self.devices:
+                writer.writerow([device.device_id, device.mac_address, device.ip_address,
+                                 device.first_seen, device.last_seen, device.ipv6_address])
+        os.replace(temporary_file, self.registry_file)
+
+    def observe(self, mac_address: str, ip_address: str, timestamp=None) -> int:
+        """Records an ARP reply or IPv6 neighbour, registering the device if it is new, and returns its device id"""
+        if timestamp is None:
+            timestamp = str(datetime.datetime.now())
+        mac_address = mac_address.lower()
+        address_field = 'ipv6_address' if ':' in ip_address else 'ip_address'
+
+        device = self.by_mac.get(mac_address)
+        if device is None:
+            device = Device(len(self.devices), mac_address, "", timestamp, timestamp)
+        else:
+            device.last_seen = timestamp
+
+        old_address = getattr(device, address_field)
+        if old_address != ip_address:
+            # Address was handed out again by DHCP; only forget the old mapping if it is still ours
+            if old_address and self.by_ip.get(old_address) is device:
+                del self.by_ip[old_address]
+            setattr(device, address_field, ip_address)
+
+        self._index(device)
+        return device.device_id
+
+    def device_id(self, ip_address: str):
+        """Device id currently using an IP address, or None if no registered device has it"""
+        device = self.by_ip.get(ip_address)
+        return device.device_id if device is not None else None
+
+    def _index(self, device: Device):
+        if device.device_id == len(self.devices):
+            self.devices.append(device)
+        self.by_mac[device.mac_address] = device
+        for address in (device.ip_address, device.ipv6_address):
+            if address:
+                self.by_ip[address] = device
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os
+import select
+import socket
+import struct
+import subprocess
+import time
+from Ping import ICMP_ECHO_IPV6, ICMP_ECHO_IPV6_REPLY, ICMP_MAX_RECV, ICMP_PORT_IPV6
+from SweepMetrics import sweep_metrics
+
+ALL_NODES = "ff02::1"
+
+
+class NeighbourScan(object):
+    """Finds IPv6 devices on the local links, the IPv6 counterpart of ARPScan.
+
+    An echo request is sent to the all-nodes multicast address on each interface, and everything that answers
+    is collected. The kernel neighbour table, which those replies will have filled in, then supplies the MAC
+    address of each device. Each device is reported once, by link-local address where it has one, as global
+    addresses come and go with privacy extensions.
+    """
+
+    def __init__(self):
+        self.interfaces = [name for index, name in socket.if_nameindex() if name != "lo"]
+        self.timeout = 2
+        self.connect_devices = []
+        self.mac_addresses = {}
+
+    def scan(self):
+        with sweep_metrics.phase("neighbour_scan"):
+            responders = self.multicast_echo()
+            neighbours = self.neighbour_table()
+
+        local_addresses = self.local_addresses()
+        by_mac = {}
+        for address, mac_address in neighbours:
+            if mac_address not in by_mac or (address.startswith("fe80") and not by_mac[mac_address].startswith("fe80")):
+                by_mac[mac_address] = address
+
+        for mac_address, address in by_mac.items():
+            self.connect_devices.append(address)
+            self.mac_addresses[address] = mac_address
+
+        neighbour_addresses = set(address for address, mac_address in neighbours)
+        for address in responders:
+            # Replies from devices the neighbour table has not caught up with yet, and not from ourselves
+            if address not in neighbour_addresses and address.split('%')[0] not in local_addresses:
+                self.connect_devices.append(address)
+
+        return self.connect_devices
+
+    def multicast_echo(self) -> list:
+        """Sends an echo request to all nodes on each interface, returning the addresses that reply"""
+        try:
+            current_socket = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.getprotobyname("ipv6-icmp"))
+        except socket.error:
+            return []
+
+        own_id = os.getpid() & 0xFFFF
+        # Checksum left as 0 for the kernel to fill in
+        packet = struct.pack("!BBHHH", ICMP_ECHO_IPV6, 0, 0, own_id, 0)
+
+        for interface in self.interfaces:
+            try:
+                current_socket.sendto(packet, (ALL_NODES, ICMP_PORT_IPV6, 0, socket.if_nametoindex(interface)))
+            except socket.error:
+                pass
+
+        responders = []
+        deadline = time.time() + self.timeout
+        while True:
+            time_left = deadline - time.time()
+            if time_left <= 0 or not select.select([current_socket], [], [], time_left)[0]:
+                break
+
+            packet_data, address = current_socket.recvfrom(ICMP_MAX_RECV)
+            icmp_type, code, checksum, packet_id, sequence = struct.unpack("!BBHHH", packet_data[:8])
+            if icmp_type != ICMP_ECHO_IPV6_REPLY or packet_id != own_id:
+                continue
+
+            host = address[0]
+            if host.startswith("fe80") and address[3]:
+                host = "%s%%%s" % (host, socket.if_indextoname(address[3]))
+            if host not in responders:
+                responders.append(host)
+
+        current_socket.close()
+        return responders
+
+    def neighbour_table(self) -> list:
+        """(address, MAC address) of each reachable entry in the kernel's IPv6 neighbour table"""
+        try:
+            output = subprocess.run(["ip", "-6", "neigh", "show"], stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+        except OSError:
+            return []
+
+        neighbours = []
+        for line in output.splitlines():
+            fields = line.split()
+            if "lladdr" not in fields or "dev" not in fields or fields[-1] in ("FAILED", "INCOMPLETE"):
+                continue
+
+            address = fields[0]
+            if address.startswith("fe80"):
+                address = "%s%%%s" % (address, fields[fields.index("dev") + 1])
+            neighbours.append((address, fields[fields.index("lladdr") + 1]))
+
+        return neighbours
+
+    def local_addresses(self) -> set:
+        """This host's own IPv6 addresses, which also answer the all-nodes echo"""
+        addresses = set()
+        try:
+            with open("/proc/net/if_inet6") as file:
+                for line in file:
+                    hex_address = line.split()[0]
+                    addresses.add(socket.inet_ntop(socket.AF_INET6, bytes.fromhex(hex_address)))
+        except OSError:
+            pass
+        return addresses
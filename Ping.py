@@ -5,11 +5,10 @@ import struct
 import select
 import time
 import signal
-import csv
 import datetime
 from icmp_messages import ICMP_CONTROL_MESSAGE, ICMPv6_CONTROL_MESSAGE
-from pathlib import Path
 from PingStats import PingStats
+from SweepMetrics import sweep_metrics
 
 # ICMP parameters
 ICMP_ECHOREPLY = 0          # Echo reply   (per RFC792)
@@ -22,6 +21,31 @@ ICMP_MAX_RECV = 2048        # Max size of incoming buffer
 MAX_SLEEP = 1000
 default_timer = time.time
 
+# Hostname -> IP address lookups already made by this process, keyed by (hostname, ipv6)
+resolved_hosts = {}
+
+
+def resolve_host(host: str, ipv6: bool = False) -> str:
+    """Resolves a hostname to an IP address, remembering the answer for the rest of the process.
+    IP address literals (what ARPScan hands us) are returned as they are without a lookup, including the
+    %interface scope of IPv6 link-local addresses.
+    """
+    key = (host, ipv6)
+    if key in resolved_hosts:
+        return resolved_hosts[key]
+
+    try:
+        socket.inet_pton(socket.AF_INET6 if ipv6 else socket.AF_INET, host.split('%')[0] if ipv6 else host)
+        address = host
+    except (socket.error, ValueError):
+        if ipv6:
+            address = socket.getaddrinfo(host, None, socket.AF_INET6)[0][4][0]
+        else:
+            address = socket.gethostbyname(host)
+
+    resolved_hosts[key] = address
+    return address
+
 
 def calculate_checksum(header: str) -> int:
     """
@@ -72,6 +96,7 @@ class Ping(object):
         # Statistics
         self.stats.destination_ip = "0.0.0.0"
         self.stats.destination_host = destination
+        self.destination_address = None
         self.stats.destination_port = ICMP_PORT
         self.stats.packets_sent = 0
         self.stats.packets_received = 0
@@ -110,12 +135,18 @@ class Ping(object):
 
         # Get IP from hostname
         try:
-            if self.ipv6:
-                self.stats.destination_port = ICMP_PORT_IPV6
-                info = socket.getaddrinfo(self.stats.destination_host, None)[0]
-                self.stats.destination_ip = info[4][0]
-            else:
-                self.stats.destination_ip = socket.gethostbyname(self.stats.destination_host)
+            with sweep_metrics.phase("dns_lookup"):
+                if self.ipv6:
+                    self.stats.destination_port = ICMP_PORT_IPV6
+                self.stats.destination_ip = resolve_host(self.stats.destination_host, self.ipv6)
+
+                if self.ipv6:
+                    # The full socket address keeps the scope id a link-local address needs
+                    self.destination_address = socket.getaddrinfo(self.stats.destination_ip,
+                                                                  self.stats.destination_port,
+                                                                  socket.AF_INET6)[0][4]
+                else:
+                    self.destination_address = (self.stats.destination_ip, self.stats.destination_port)
         except socket.error:
             error_type, error_value, etb = sys.exc_info()
             self._stderr.write("\nERROR: Unknown host: %s (%s)\n" % (self.stats.destination_host, error_value.args[1]))
@@ -134,12 +165,13 @@ class Ping(object):
 
         """
         delay = None
-        sock_af = socket.AF_INET
+        sock_af = socket.AF_INET6 if self.ipv6 else socket.AF_INET
         sock_type = socket.SOCK_RAW
-        sock_protocol = socket.getprotobyname("icmp")
 
         try:
-            current_socket = socket.socket(sock_af, sock_type, sock_protocol)
+            with sweep_metrics.phase("socket_setup"):
+                sock_protocol = socket.getprotobyname("ipv6-icmp" if self.ipv6 else "icmp")
+                current_socket = socket.socket(sock_af, sock_type, sock_protocol)
         except socket.error:
             error_type, error_value, etb = sys.exc_info()
             self._stderr.write("socket.error: %s\n" % error_value)
@@ -155,18 +187,17 @@ class Ping(object):
             return delay
 
         self.stats.packets_sent += 1
+        sweep_metrics.increment("packets_sent")
 
         receive_time, packet_size, ip_header, icmp_header = self.receive_ping(current_socket)
         # print("Received ping at: %2f" % receive_time)
 
         self.packet_sent_time.append(send_time)
-        self.packet_received_time.append(receive_time)
+        if receive_time:
+            self.packet_received_time.append(receive_time)
 
         current_socket.close()
 
-        icmp_sequence_number = icmp_header["seq_number"]
-        icmp_type = icmp_header["type"]
-        icmp_code = icmp_header["code"]
         host_address = self.stats.destination_ip
 
         if host_address == self.stats.destination_host:
@@ -175,9 +206,11 @@ class Ping(object):
             from_info = "%s (%s)" % (self.stats.destination_host, host_address)
 
         if receive_time:
-            ip_header_ttl = ip_header["ttl"]
+            # ICMPv6 raw sockets are not given the IP header, so there is no hop limit to report
+            ip_header_ttl = ip_header["ttl"] if ip_header else None
             delay = (receive_time - send_time) * 1000.0
             self.stats.packets_received += 1
+            sweep_metrics.increment("packets_received")
             self.stats.total_time += delay
 
             if self.stats.min_time > delay:
@@ -187,7 +220,8 @@ class Ping(object):
         else:
             # Timed out - Print out returned ICMP message
             delay = None
-            self._stdout.write("Timeout.")
+            sweep_metrics.increment("packets_timed_out")
+            self._stdout.write("Timeout.\n")
 
         return delay
 
@@ -203,9 +237,10 @@ class Ping(object):
 
         """
         checksum = 0
+        echo_type = ICMP_ECHO_IPV6 if self.ipv6 else ICMP_ECHO
 
         # Make a dummy header with a 0 checksum.
-        header = struct.pack("!BBHHH", ICMP_ECHO, 0, checksum, self.own_id, self.sequence_number)
+        header = struct.pack("!BBHHH", echo_type, 0, checksum, self.own_id, self.sequence_number)
         pad_bytes = []
         start_val = 0x42
 
@@ -214,12 +249,14 @@ class Ping(object):
 
         data = bytearray(pad_bytes)
 
-        # Calculate the checksum on the data and the dummy header. Checksum is in network order
-        checksum = calculate_checksum(header + data)
+        # Calculate the checksum on the data and the dummy header. Checksum is in network order.
+        # The ICMPv6 checksum covers a pseudo-header with the source address, so the kernel fills that one in
+        if not self.ipv6:
+            checksum = calculate_checksum(header + data)
 
         # Now that we have the right checksum, we put that in. It's just easier
         # to make up a new header than to stuff it into the dummy
-        header = struct.pack("!BBHHH", ICMP_ECHO, 0, checksum, self.own_id, self.sequence_number)
+        header = struct.pack("!BBHHH", echo_type, 0, checksum, self.own_id, self.sequence_number)
 
         # Build packet and record time it was sent
         packet = header + data
@@ -227,7 +264,7 @@ class Ping(object):
         # print(send_time)
 
         try:
-            current_socket.sendto(packet, (self.stats.destination_ip, self.stats.destination_port))
+            current_socket.sendto(packet, self.destination_address)
         except socket.error:
             error_type, error_value, etb = sys.exc_info()
             self._stderr.write("General failure (%s)\n" % (error_value.args[1]))
@@ -248,6 +285,7 @@ class Ping(object):
         """
 
         time_left = self.timeout / 1000.0
+        reply_type = ICMP_ECHO_IPV6_REPLY if self.ipv6 else ICMP_ECHOREPLY
 
         while True:
 
@@ -255,22 +293,34 @@ class Ping(object):
             open_connection = select.select([current_socket], [], [], time_left)
             wait_time = default_timer() - start_time
             time_received = default_timer()
+            sweep_metrics.record("select_wait", wait_time)
+
+            if not open_connection[0]:
+                # select() timed out, nothing to read
+                return None, 0, None, None
 
             packet_data, address = current_socket.recvfrom(ICMP_MAX_RECV)
-            icmp_header_raw = packet_data[20:28]
+
+            if self.ipv6:
+                # ICMPv6 raw sockets receive the ICMP message alone, without the IPv6 header
+                ip_header = None
+                ip_header_length = 0
+            else:
+                ip_header = self.convert_header_dictionary(names=["version", "type", "length", "id", "flags", "ttl",
+                                                                  "protocol", "checksum", "src_ip", "dest_ip"],
+                                                           struct_format="!BBHHHBBHII", data = packet_data[:20])
+                ip_header_length = (packet_data[0] & 0x0f) * 4
+
+            icmp_header_raw = packet_data[ip_header_length:ip_header_length + 8]
             icmp_header = self.convert_header_dictionary(names=["type", "code", "checksum", "packet_id", "seq_number"],
                                                          struct_format="!BBHHH", data=icmp_header_raw)
-            ip_header = self.convert_header_dictionary(names=["version", "type", "length", "id", "flags", "ttl",
-                                                              "protocol", "checksum", "src_ip", "dest_ip"],
-                                                       struct_format="!BBHHHBBHII", data = packet_data[:20])
 
-            if open_connection[0] is None:
-                return None, 0, ip_header, icmp_header
-
-            if icmp_header["packet_id"] == self.own_id:
-                data_size = len(packet_data) - 28
+            if icmp_header["type"] == reply_type and icmp_header["packet_id"] == self.own_id:
+                data_size = len(packet_data) - ip_header_length - 8
                 return time_received, (data_size + 8), ip_header, icmp_header
 
+            # Raw sockets see every ICMP message on the host, not just replies to our own echoes
+            sweep_metrics.increment("foreign_icmp_dropped")
             time_left -= wait_time
 
             if time_left <= 0:
@@ -341,12 +391,21 @@ class Ping(object):
                 jitter.append(window - 1)
                 i += 2
             except IndexError:
-                sum(jitter) / float(len(jitter))
+                break
+
+        if not jitter:
+            return 0.00
 
         return sum(jitter) / float(len(jitter))
 
     def export_data(self):
         """Exports the measurements accumulated above, and appends them to a CSV for later analysis"""
+        from Pipeline import CsvSink
+
+        CsvSink().write(self.measurement())
+
+    def measurement(self) -> dict:
+        """Summarises the pings sent so far as a record with the fields of the daily CSV"""
         self.calculate_packet_loss()
         jitter = 0.00
         bandwidth = 0.00
@@ -357,38 +416,17 @@ class Ping(object):
             bandwidth = self.calculate_bandwidth()
             jitter = self.calculate_jitter()
 
-        # TODO: Use Python 3 syntax to export to CSV
-        timestamp = datetime.datetime.now()
-        timestamp.isoformat()
-        daily_csv_data_dump = Path('data/' + str(datetime.date.today()) + '.csv')
-
-        if daily_csv_data_dump.is_file():
-            csv_data_storage = open('data/' + str(datetime.date.today()) + '.csv', 'a')
-            csv_data_storage.write(("\n" +
-                                    str(self.stats.destination_ip) + "," +
-                                    str(timestamp) + "," +
-                                    str(self.stats.lost_rate) + "," +
-                                    str(self.stats.min_time) + "," +
-                                    str(self.stats.average_time) + "," +
-                                    str(self.stats.max_time) + "," +
-                                    str(bandwidth) + "," +
-                                    str(jitter)))
-            csv_data_storage.close()
-        else:
-            # If the file doesn't exist yet, we need the header file to be inserted
-            csv_data_storage = open('data/' + str(datetime.date.today()) + '.csv', 'a')
-            csv_data_storage.write(
-                "IP Address,Timestamp,Packet Loss,Min RTT,Ave RTT,Max RTT,Bandwidth,Packet Delay Variation")
-            csv_data_storage.write(("\n" +
-                                    str(self.stats.destination_ip) + "," +
-                                    str(timestamp) + "," +
-                                    str(self.stats.lost_rate) + "," +
-                                    str(self.stats.min_time) + "," +
-                                    str(self.stats.average_time) + "," +
-                                    str(self.stats.max_time) + "," +
-                                    str(bandwidth) + "," +
-                                    str(jitter)))
-            csv_data_storage.close()
+        return {
+            "IP Address": self.stats.destination_ip,
+            "Timestamp": str(datetime.datetime.now()),
+            "Packet Loss": self.stats.lost_rate,
+            "Min RTT": self.stats.min_time,
+            "Ave RTT": self.stats.average_time,
+            "Max RTT": self.stats.max_time,
+            "Bandwidth": bandwidth,
+            "Packet Delay Variation": jitter,
+            "Device ID": None,
+        }
 
     def convert_header_dictionary(self, names, struct_format, data) -> dict:
         """Example function with PEP 484 type annotations.
@@ -469,5 +507,4 @@ class Ping(object):
                 time.sleep((MAX_SLEEP - delay) / 1000.0)
 
         self.calculate_packet_loss()
-        self.export_data()
         return self.stats
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+from SweepMetrics import sweep_metrics
+
+# Fields of a measurement record, in the order they are written to the daily CSV
+RECORD_FIELDS = ["IP Address", "Timestamp", "Packet Loss", "Min RTT", "Ave RTT", "Max RTT", "Bandwidth",
+                 "Packet Delay Variation", "Device ID"]
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Queued to every sink after the last record of a sweep
+END_OF_SWEEP = object()
+END_OF_STREAM = object()
+
+
+# Stages: generators that take an iterable of records and yield records
+
+def filter_records(records, predicate):
+    """Passes on only the records the predicate accepts"""
+    for record in records:
+        if predicate(record):
+            yield record
+
+
+def enrich_device_ids(records, registry):
+    """Fills in the Device ID of each record from the device registry"""
+    for record in records:
+        if record.get("Device ID") is None:
+            record["Device ID"] = registry.device_id(record["IP Address"])
+        yield record
+
+
+def device_key(record: dict):
+    """Registry device id if known, otherwise the IP address"""
+    return record["Device ID"] if record.get("Device ID") is not None else record["IP Address"]
+
+
+def record_time(record: dict) -> float:
+    """The record's Timestamp as seconds since the epoch"""
+    timestamp = record["Timestamp"]
+    # str(datetime) leaves out the microseconds when they happen to be zero
+    timestamp_format = '%Y-%m-%d %H:%M:%S.%f' if '.' in timestamp else '%Y-%m-%d %H:%M:%S'
+    return datetime.datetime.strptime(timestamp, timestamp_format).timestamp()
+
+
+# Sinks: consume records on their own thread, fed through a bounded queue
+
+class Sink(object):
+    """Base class for record consumers.
+
+    Each sink is fed through its own bounded queue and drained by its own thread, so a sink that is slow
+    (a full disk, a stalled stdout pipe) holds up only itself. When a sink's queue is full the producer waits
+    for it, which is the back-pressure; a sink marked lossy has the record dropped and counted instead.
+    """
+    lossy = False
+    queue_size = 256
+
+    def write(self, record: dict):
+        raise NotImplementedError
+
+    def end_sweep(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CsvSink(Sink):
+    """Appends records to the daily CSV file, data/<date>.csv"""
+
+    def __init__(self, data_directory: str = DATA_DIRECTORY):
+        self.data_directory = data_directory
+
+    def write(self, record: dict):
+        with sweep_metrics.phase("export_data"):
+            daily_csv_data_dump = os.path.join(self.data_directory, str(datetime.date.today()) + '.csv')
+
+            with open(daily_csv_data_dump, 'a') as csv_data_storage:
+                if csv_data_storage.tell() == 0:
+                    # If the file doesn't exist yet, we need the header file to be inserted
+                    csv_data_storage.write(",".join(RECORD_FIELDS))
+                csv_data_storage.write("\n" + ",".join("" if record[field] is None else str(record[field])
+                                                       for field in RECORD_FIELDS))
+
+
+class JsonLinesSink(Sink):
+    """Writes each record as a line of JSON, to stdout by default"""
+    lossy = True
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def write(self, record: dict):
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+
+class QualityWindowSink(Sink):
+    """Feeds records into a QualityWindow rolling score"""
+
+    def __init__(self, quality_window):
+        self.quality_window = quality_window
+
+    def write(self, record: dict):
+        self.quality_window.add(device_key(record), record["Ave RTT"], record["Bandwidth"],
+                                record["Packet Loss"], record["Packet Delay Variation"], record_time(record))
+
+
+class ContentionSink(Sink):
+    """Feeds records into a ContentionAnalysis, merging the sweep into the saved state and reporting at its end"""
+
+    def __init__(self, contention, stream=None):
+        self.contention = contention
+        self.stream = stream if stream is not None else sys.stdout
+
+    def write(self, record: dict):
+        self.report(self.contention.add_row(device_key(record), record["IP Address"], record["Timestamp"], record))
+
+    def end_sweep(self):
+        with self.contention.update():
+            flagged = self.contention.flush()
+        self.report(flagged)
+
+    def report(self, flagged: list):
+        for metric, leader, follower, correlation in flagged:
+            self.stream.write("Contention: %s spike on device %s followed by device %s (lead correlation %.2f)\n"
+                              % (metric, self.contention.describe(leader), self.contention.describe(follower),
+                                 correlation))
+
+
+class Pipeline(object):
+    """Fans a stream of records out to several sinks in a single pass"""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+        self.queues = []
+        self.threads = []
+
+        for sink in sinks:
+            sink_queue = queue.Queue(maxsize=sink.queue_size)
+            thread = threading.Thread(target=self._drain, args=(sink, sink_queue), daemon=True)
+            thread.start()
+            self.queues.append(sink_queue)
+            self.threads.append(thread)
+
+    def run(self, records):
+        """Consumes an iterable of records (e.g. a generator of stages over the probes) for one sweep.
+
+        Returns once every sink that is not lossy has handled the end of the sweep, so the time they spend on it
+        (the CSV export) is counted in the sweep's metrics. Lossy sinks are never waited for, so a stalled stdout
+        reader cannot hold up the next sweep.
+        """
+        for record in records:
+            for sink, sink_queue in zip(self.sinks, self.queues):
+                # Each sink gets its own copy, so one sink cannot change what another sees
+                self._put(sink, sink_queue, dict(record))
+
+        for sink, sink_queue in zip(self.sinks, self.queues):
+            if not sink.lossy:
+                sink_queue.put(END_OF_SWEEP)
+                continue
+            try:
+                sink_queue.put_nowait(END_OF_SWEEP)
+            except queue.Full:
+                pass
+        for sink, sink_queue in zip(self.sinks, self.queues):
+            if not sink.lossy:
+                sink_queue.join()
+
+    def close(self):
+        """Waits for every sink to finish what it has been given"""
+        for sink_queue in self.queues:
+            sink_queue.put(END_OF_STREAM)
+        for thread in self.threads:
+            thread.join()
+
+    def _put(self, sink: Sink, sink_queue: queue.Queue, record: dict):
+        if not sink.lossy:
+            sink_queue.put(record)
+            return
+
+        try:
+            sink_queue.put_nowait(record)
+        except queue.Full:
+            sweep_metrics.increment("records_dropped")
+
+    def _drain(self, sink: Sink, sink_queue: queue.Queue):
+        while True:
+            item = sink_queue.get()
+            try:
+                if item is END_OF_STREAM:
+                    sink.close()
+                    return
+                elif item is END_OF_SWEEP:
+                    sink.end_sweep()
+                else:
+                    sink.write(item)
+            except Exception:
+                # A broken sink must keep draining, or the producer would eventually block on its queue
+                error_type, error_value, etb = sys.exc_info()
+                sys.stderr.write("ERROR: %s failed: %s\n" % (type(sink).__name__, error_value))
+            finally:
+                sink_queue.task_done()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import threading
+import time
+from array import array
+from data.QualityScore import calculate_quality_score
+
+
+class QualityWindow(object):
+    """Rolling quality score over the last `window` seconds, kept in a fixed-size ring buffer.
+
+    Samples are held in preallocated arrays and running totals are updated as samples enter and leave, so
+    adding a sample or reading the score is O(1) (amortised) and memory never grows past `capacity` samples.
+    If the buffer fills before samples age out, the oldest are dropped early.
+    """
+
+    def __init__(self, window: int = 3600, capacity: int = 4096):
+        self.window = window
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+        # Ring buffer: slots [tail, tail + size) hold live samples, oldest first
+        self.timestamps = array('d', [0.0]) * capacity
+        self.scores = array('d', [0.0]) * capacity
+        self.devices = [None] * capacity
+        self.tail = 0
+        self.size = 0
+
+        self.total = 0.0
+        self.device_totals = {}
+        self.device_counts = {}
+
+    def add(self, device, ave_rtt: float, bandwidth: float, packet_loss: float, jitter: float, timestamp=None):
+        """Adds one measurement row (as exported to the daily CSV) for a device"""
+        if timestamp is None:
+            timestamp = time.time()
+        score = calculate_quality_score(ave_rtt, bandwidth, packet_loss, jitter)
+
+        with self.lock:
+            self._expire(timestamp)
+            if self.size == self.capacity:
+                self._drop_oldest()
+
+            head = (self.tail + self.size) % self.capacity
+            self.timestamps[head] = timestamp
+            self.scores[head] = score
+            self.devices[head] = device
+            self.size += 1
+
+            self.total += score
+            self.device_totals[device] = self.device_totals.get(device, 0.0) + score
+            self.device_counts[device] = self.device_counts.get(device, 0) + 1
+
+    def score(self, now=None):
+        """Current quality score across all devices, or None if nothing was measured in the window"""
+        with self.lock:
+            self._expire(time.time() if now is None else now)
+            if not self.size:
+                return None
+            return self.total / self.size
+
+    def device_score(self, device, now=None):
+        """Current quality score for a single device, or None if it was not measured in the window"""
+        with self.lock:
+            self._expire(time.time() if now is None else now)
+            if device not in self.device_counts:
+                return None
+            return self.device_totals[device] / self.device_counts[device]
+
+    def device_scores(self, now=None) -> dict:
+        with self.lock:
+            self._expire(time.time() if now is None else now)
+            return {device: self.device_totals[device] / self.device_counts[device] for device in self.device_counts}
+
+    def prometheus(self) -> str:
+        """Renders the current scores as Prometheus gauges"""
+        overall = self.score()
+        lines = ["# TYPE localqos_quality_score gauge"]
+        if overall is not None:
+            lines.append("localqos_quality_score %f" % overall)
+        for device, score in sorted(self.device_scores().items(), key=lambda item: str(item[0])):
+            lines.append('localqos_quality_score{device="%s"} %f' % (device, score))
+        return "\n".join(lines) + "\n"
+
+    def _expire(self, now: float):
+        cutoff = now - self.window
+        while self.size and self.timestamps[self.tail] < cutoff:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        score = self.scores[self.tail]
+        device = self.devices[self.tail]
+        self.devices[self.tail] = None
+        self.tail = (self.tail + 1) % self.capacity
+        self.size -= 1
+
+        self.device_counts[device] -= 1
+        if self.device_counts[device]:
+            self.device_totals[device] -= score
+        else:
+            del self.device_counts[device]
+            del self.device_totals[device]
+
+        if self.size:
+            self.total -= score
+        else:
+            # Reset rather than subtract, so floating point error cannot build up over a long run
+            self.total = 0.0
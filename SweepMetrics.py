@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+default_timer = time.perf_counter
+
+# Phases timed during a sweep, in the order they normally happen
+PHASES = ("arp_scan", "neighbour_scan", "dns_lookup", "socket_setup", "select_wait", "export_data")
+
+# Counters kept for the lifetime of the process
+COUNTERS = ("packets_sent", "packets_received", "packets_timed_out", "foreign_icmp_dropped", "records_dropped")
+
+
+class SweepMetrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.phase_totals = dict.fromkeys(PHASES, 0.0)
+        self.sweeps = 0
+        self.sweep_start = None
+        self.sweep_phases = dict.fromkeys(PHASES, 0.0)
+        self.sweep_counters = dict.fromkeys(COUNTERS, 0)
+        self.last_summary = {}
+
+    def increment(self, counter: str, amount: int = 1):
+        """Bumps one of the COUNTERS, both for the process and the current sweep."""
+        with self.lock:
+            self.counters[counter] += amount
+            self.sweep_counters[counter] += amount
+
+    def record(self, phase: str, seconds: float):
+        """Adds the time spent in a phase to the process and sweep totals."""
+        with self.lock:
+            self.phase_totals[phase] += seconds
+            self.sweep_phases[phase] += seconds
+
+    @contextmanager
+    def phase(self, phase: str):
+        """Times the enclosed block and records it against the given phase."""
+        start_time = default_timer()
+        try:
+            yield
+        finally:
+            self.record(phase, default_timer() - start_time)
+
+    def start_sweep(self):
+        with self.lock:
+            self.sweep_start = default_timer()
+            self.sweep_phases = dict.fromkeys(PHASES, 0.0)
+            self.sweep_counters = dict.fromkeys(COUNTERS, 0)
+
+    def end_sweep(self) -> dict:
+        """Closes the current sweep and returns its phase breakdown as a dictionary.
+
+        Whatever part of the sweep was not spent in a timed phase is reported as "other", which is mostly
+        the sleeps between echo requests.
+        """
+        with self.lock:
+            duration = default_timer() - self.sweep_start if self.sweep_start is not None else 0.0
+            self.sweeps += 1
+            self.last_summary = {
+                "sweep": self.sweeps,
+                "timestamp": time.time(),
+                "duration": duration,
+                "phases": dict(self.sweep_phases),
+                "other": max(duration - sum(self.sweep_phases.values()), 0.0),
+                "counters": dict(self.sweep_counters),
+            }
+            self.sweep_start = None
+            return self.last_summary
+
+    def summary_json(self) -> str:
+        with self.lock:
+            return json.dumps(self.last_summary, sort_keys=True)
+
+    def prometheus(self) -> str:
+        """Renders the process totals in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for counter in COUNTERS:
+                name = "localqos_%s_total" % counter
+                lines.append("# TYPE %s counter" % name)
+                lines.append("%s %d" % (name, self.counters[counter]))
+
+            lines.append("# TYPE localqos_phase_seconds_total counter")
+            for phase in PHASES:
+                lines.append('localqos_phase_seconds_total{phase="%s"} %f' % (phase, self.phase_totals[phase]))
+
+            lines.append("# TYPE localqos_sweeps_total counter")
+            lines.append("localqos_sweeps_total %d" % self.sweeps)
+
+            if self.last_summary:
+                lines.append("# TYPE localqos_last_sweep_seconds gauge")
+                lines.append("localqos_last_sweep_seconds %f" % self.last_summary["duration"])
+
+        return "\n".join(lines) + "\n"
+
+
+def metrics_request_handler():
+    # http.server pulls in most of the email package, so it is only imported once an endpoint is asked for
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = self.server.metrics.prometheus()
+                if self.server.quality_window is not None:
+                    body += self.server.quality_window.prometheus()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/summary":
+                body = self.server.metrics.summary_json() + "\n"
+                content_type = "application/json"
+            elif self.path == "/quality" and self.server.quality_window is not None:
+                body = json.dumps({"quality_score": self.server.quality_window.score(),
+                                   "devices": self.server.quality_window.device_scores()}, sort_keys=True) + "\n"
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # Keep scrapes out of cron.log
+            pass
+
+    return MetricsRequestHandler
+
+
+def serve_metrics(metrics: SweepMetrics, port: int, quality_window=None):
+    """Serves /metrics (Prometheus text) and /summary (last sweep as JSON) on localhost from a daemon thread.
+
+    If a QualityWindow is given, its rolling scores are added to /metrics and served as JSON on /quality.
+    Returns None if the port cannot be bound (e.g. a previous cron run still holds it), as measuring matters
+    more than serving the metrics.
+    """
+    from http.server import HTTPServer
+
+    try:
+        server = HTTPServer(("127.0.0.1", port), metrics_request_handler())
+    except OSError as error:
+        sys.stderr.write("WARNING: not serving metrics on port %d: %s\n" % (port, error.strerror))
+        return None
+    server.metrics = metrics
+    server.quality_window = quality_window
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+sweep_metrics = SweepMetrics()
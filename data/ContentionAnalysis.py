@@ -0,0 +1,365 @@
+import csv
+import fcntl
+import json
+import math
+import os
+import sys
+from contextlib import contextmanager
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Measurements from the daily CSV that are correlated across devices
+CONTENTION_METRICS = ('Ave RTT', 'Packet Loss')
+
+# A device not measured for this many sweeps (30 days of 5 minute sweeps) gives its slot up for reuse
+MAX_IDLE_SWEEPS = 8640
+
+
+def family_key(device, ip_address: str) -> tuple:
+    """Key of a device's series: a dual-stack device is measured over IPv4 and IPv6, and each is its own series"""
+    return device, 'v6' if ':' in ip_address else 'v4'
+
+
+class PairwiseMoments(object):
+    """Running means, variances and co-moments of x[i] against y[j] for every pair of device slots.
+
+    Updated one observation at a time (Welford's method), so months of sweeps never have to be revisited.
+    Only pairs observed together are updated, which keeps the estimates right when devices come and go.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.n = []
+        self.mean_x = []
+        self.mean_y = []
+        self.m2_x = []
+        self.m2_y = []
+        self.c = []
+
+    def grow(self, size: int):
+        matrices = (self.n, self.mean_x, self.mean_y, self.m2_x, self.m2_y, self.c)
+        while self.size < size:
+            for matrix in matrices:
+                for row in matrix:
+                    row.append(0.0)
+                matrix.append([0.0] * (self.size + 1))
+            self.size += 1
+
+    def reset(self, slot: int):
+        """Forgets everything about a slot, in both its row and its column, so it can be given to another device"""
+        for matrix in (self.n, self.mean_x, self.mean_y, self.m2_x, self.m2_y, self.c):
+            matrix[slot] = [0.0] * self.size
+            for row in matrix:
+                row[slot] = 0.0
+
+    def update(self, xs: dict, ys: dict):
+        """Adds one observation for every pair (i in xs, j in ys). Keys are device slots."""
+        for i, x in xs.items():
+            n, mean_x, mean_y = self.n[i], self.mean_x[i], self.mean_y[i]
+            m2_x, m2_y, c = self.m2_x[i], self.m2_y[i], self.c[i]
+            for j, y in ys.items():
+                n[j] += 1
+                dx = x - mean_x[j]
+                dy = y - mean_y[j]
+                mean_x[j] += dx / n[j]
+                mean_y[j] += dy / n[j]
+                m2_x[j] += dx * (x - mean_x[j])
+                m2_y[j] += dy * (y - mean_y[j])
+                c[j] += dx * (y - mean_y[j])
+
+    def count(self, i: int, j: int) -> int:
+        return int(self.n[i][j])
+
+    def covariance(self, i: int, j: int):
+        if self.n[i][j] < 2:
+            return None
+        return self.c[i][j] / (self.n[i][j] - 1)
+
+    def correlation(self, i: int, j: int):
+        if self.n[i][j] < 2 or self.m2_x[i][j] <= 0 or self.m2_y[i][j] <= 0:
+            return None
+        return self.c[i][j] / math.sqrt(self.m2_x[i][j] * self.m2_y[i][j])
+
+    def to_dict(self) -> dict:
+        return {'n': self.n, 'mean_x': self.mean_x, 'mean_y': self.mean_y,
+                'm2_x': self.m2_x, 'm2_y': self.m2_y, 'c': self.c}
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        moments = cls()
+        moments.n, moments.mean_x, moments.mean_y = state['n'], state['mean_x'], state['mean_y']
+        moments.m2_x, moments.m2_y, moments.c = state['m2_x'], state['m2_y'], state['c']
+        moments.size = len(moments.n)
+        return moments
+
+
+class SeriesCorrelation(object):
+    """Cross-device correlation of a single metric, one aligned time step per sweep.
+
+    Keeps two matrices: devices against each other in the same sweep, and each device in the previous sweep
+    against every device in this one. A strong lagged correlation from device A to device B means A tends to
+    get worse a sweep before B does, which is what A's traffic degrading B looks like.
+    """
+
+    def __init__(self, spike_threshold: float = 2.0, lead_threshold: float = 0.5, min_samples: int = 12):
+        self.spike_threshold = spike_threshold
+        self.lead_threshold = lead_threshold
+        self.min_samples = min_samples
+
+        self.same = PairwiseMoments()
+        self.lagged = PairwiseMoments()
+
+        # Per device running mean/variance, for spotting spikes
+        self.n = []
+        self.mean = []
+        self.m2 = []
+
+        self.previous = {}
+        self.previous_spikes = set()
+
+    def grow(self, size: int):
+        while len(self.n) < size:
+            self.n.append(0)
+            self.mean.append(0.0)
+            self.m2.append(0.0)
+        self.same.grow(size)
+        self.lagged.grow(size)
+
+    def release(self, slot: int):
+        self.n[slot] = 0
+        self.mean[slot] = 0.0
+        self.m2[slot] = 0.0
+        self.previous.pop(slot, None)
+        self.previous_spikes.discard(slot)
+        self.same.reset(slot)
+        self.lagged.reset(slot)
+
+    def z_score(self, slot: int, value: float):
+        if self.n[slot] < self.min_samples or self.m2[slot] <= 0:
+            return None
+        return (value - self.mean[slot]) / math.sqrt(self.m2[slot] / (self.n[slot] - 1))
+
+    def update(self, values: dict) -> list:
+        """Adds a sweep of {slot: value} and returns (leader, follower, lead correlation) for each device that
+        spiked last sweep where a device it usually leads has spiked in this one.
+        """
+        spikes = set()
+        for slot, value in values.items():
+            z = self.z_score(slot, value)
+            if z is not None and z > self.spike_threshold:
+                spikes.add(slot)
+
+        flagged = []
+        for leader in self.previous_spikes:
+            for follower in spikes:
+                if leader == follower or self.lagged.count(leader, follower) < self.min_samples:
+                    continue
+                correlation = self.lagged.correlation(leader, follower)
+                if correlation is not None and correlation >= self.lead_threshold:
+                    flagged.append((leader, follower, correlation))
+
+        self.same.update(values, values)
+        self.lagged.update(self.previous, values)
+
+        for slot, value in values.items():
+            self.n[slot] += 1
+            delta = value - self.mean[slot]
+            self.mean[slot] += delta / self.n[slot]
+            self.m2[slot] += delta * (value - self.mean[slot])
+
+        self.previous = values
+        self.previous_spikes = spikes
+        return flagged
+
+    def leaders(self) -> list:
+        """Every (leader, follower, lead correlation) pair over the lead threshold, strongest first"""
+        pairs = []
+        for leader in range(self.lagged.size):
+            for follower in range(self.lagged.size):
+                if leader == follower or self.lagged.count(leader, follower) < self.min_samples:
+                    continue
+                correlation = self.lagged.correlation(leader, follower)
+                if correlation is not None and correlation >= self.lead_threshold:
+                    pairs.append((leader, follower, correlation))
+        return sorted(pairs, key=lambda pair: pair[2], reverse=True)
+
+    def to_dict(self) -> dict:
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2,
+                'previous': [[slot, value] for slot, value in self.previous.items()],
+                'previous_spikes': sorted(self.previous_spikes),
+                'same': self.same.to_dict(), 'lagged': self.lagged.to_dict()}
+
+    def load_dict(self, state: dict):
+        self.n, self.mean, self.m2 = state['n'], state['mean'], state['m2']
+        self.previous = {slot: value for slot, value in state['previous']}
+        self.previous_spikes = set(state['previous_spikes'])
+        self.same = PairwiseMoments.from_dict(state['same'])
+        self.lagged = PairwiseMoments.from_dict(state['lagged'])
+
+
+class ContentionAnalysis(object):
+    """Streams measurement rows into per-metric SeriesCorrelation engines, one sweep at a time.
+
+    When replaying CSVs, rows are grouped into sweeps as they arrive: a sweep ends when a device is measured a
+    second time. A live caller that knows where its sweeps end passes infer_sweeps=False and calls flush() itself.
+    Devices are keyed by registry device id, or by IP address for rows without one, together with the address
+    family, and each key is given a slot in the correlation matrices the first time it is seen. Slots of devices that have not been seen for
+    max_idle_sweeps are released and reused, so DHCP churn among unregistered hosts cannot grow the matrices
+    without bound. State is saved as JSON between runs.
+    """
+
+    def __init__(self, state_file: str = os.path.join(DATA_DIRECTORY, 'contention.json'),
+                 max_idle_sweeps: int = MAX_IDLE_SWEEPS, infer_sweeps: bool = True, **thresholds):
+        self.state_file = state_file
+        self.max_idle_sweeps = max_idle_sweeps
+        self.infer_sweeps = infer_sweeps
+        self.devices = []
+        self.slots = {}
+        self.last_active = []
+        self.sweeps = 0
+        self.series = {metric: SeriesCorrelation(**thresholds) for metric in CONTENTION_METRICS}
+        self.sweep = {}
+        self.last_timestamp = ''
+
+    def load(self):
+        if not os.path.isfile(self.state_file):
+            return self
+
+        with open(self.state_file) as file:
+            state = json.load(file)
+        # JSON has no tuples, so (device, family) keys come back as lists
+        self.devices = [tuple(device) if isinstance(device, list) else device for device in state['devices']]
+        self.slots = {device: slot for slot, device in enumerate(self.devices) if device is not None}
+        self.sweeps = state.get('sweeps', 0)
+        self.last_active = state.get('last_active', [self.sweeps] * len(self.devices))
+        # Rows already accepted into the current sweep are kept, so never move the high-water mark backwards
+        self.last_timestamp = max(self.last_timestamp, state['last_timestamp'])
+        for metric, series in self.series.items():
+            series.load_dict(state['series'][metric])
+        return self
+
+    @contextmanager
+    def update(self):
+        """Rereads the saved state and saves it afterwards, holding a lock throughout.
+
+        Cron runs can overlap; each one applies its sweeps on top of whatever the others have saved, rather than
+        the last run to finish overwriting the rest.
+        """
+        with open(self.state_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield self
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        state = {'devices': self.devices, 'last_timestamp': self.last_timestamp,
+                 'sweeps': self.sweeps, 'last_active': self.last_active,
+                 'series': {metric: series.to_dict() for metric, series in self.series.items()}}
+        temporary_file = self.state_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary_file, self.state_file)
+
+    def add_row(self, device, ip_address: str, timestamp: str, values: dict) -> list:
+        """Adds one device's measurements. Returns flags for the previous sweep if this row started a new one."""
+        if timestamp <= self.last_timestamp:
+            # Already seen, e.g. when replaying a day that was partly analysed live
+            return []
+
+        key = family_key(device, ip_address)
+        flagged = []
+        if self.infer_sweeps and key in self.sweep:
+            flagged = self.flush()
+
+        self.sweep[key] = values
+        self.last_timestamp = timestamp
+        return flagged
+
+    def flush(self) -> list:
+        """Closes the current sweep, returning (metric, leader device, follower device, correlation) flags"""
+        self.sweeps += 1
+        for device in self.sweep:
+            if device not in self.slots:
+                self._allocate(device)
+            self.last_active[self.slots[device]] = self.sweeps
+
+        flagged = []
+        for metric, series in self.series.items():
+            series.grow(len(self.devices))
+            values = {self.slots[device]: float(values[metric]) for device, values in self.sweep.items()}
+            for leader, follower, correlation in series.update(values):
+                flagged.append((metric, self.devices[leader], self.devices[follower], correlation))
+
+        self.sweep = {}
+        self._expire()
+        return flagged
+
+    def _allocate(self, device):
+        if None in self.devices:
+            slot = self.devices.index(None)
+            self.devices[slot] = device
+        else:
+            slot = len(self.devices)
+            self.devices.append(device)
+            self.last_active.append(self.sweeps)
+        self.slots[device] = slot
+
+    def _expire(self):
+        for slot, device in enumerate(self.devices):
+            if device is not None and self.sweeps - self.last_active[slot] > self.max_idle_sweeps:
+                for series in self.series.values():
+                    series.release(slot)
+                del self.slots[device]
+                self.devices[slot] = None
+
+    @staticmethod
+    def describe(device) -> str:
+        """Prints a (device, family) key as e.g. '3 (v6)'"""
+        if isinstance(device, tuple):
+            return "%s (%s)" % device
+        return str(device)
+
+    def leaders(self) -> list:
+        """Current (metric, leader device, follower device, correlation) relationships, strongest first"""
+        pairs = []
+        for metric, series in self.series.items():
+            for leader, follower, correlation in series.leaders():
+                pairs.append((metric, self.devices[leader], self.devices[follower], correlation))
+        return sorted(pairs, key=lambda pair: pair[3], reverse=True)
+
+    def read_data(self, csv_data_file: str) -> list:
+        """Replays a daily CSV file through the analysis, returning any flags raised"""
+        flagged = []
+        with open(csv_data_file) as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                device_id = row.get('Device ID')
+                device = int(device_id) if device_id else row['IP Address']
+                values = {metric: row[metric] for metric in CONTENTION_METRICS}
+                flagged += self.add_row(device, row['IP Address'], row['Timestamp'], values)
+        return flagged
+
+
+def main():
+    # Replays the daily CSVs given on the command line (in date order) and prints who leads whom
+    analysis = ContentionAnalysis()
+    flagged = []
+    with analysis.update():
+        for csv_data_file in sorted(sys.argv[1:]):
+            flagged += analysis.read_data(csv_data_file)
+        flagged += analysis.flush()
+
+    for metric, leader, follower, correlation in flagged:
+        print("%s: spike on %s followed by %s (lead correlation %.2f)"
+              % (metric, analysis.describe(leader), analysis.describe(follower), correlation))
+
+    print("Metric\tLeader\tFollower\tLead correlation")
+    for metric, leader, follower, correlation in analysis.leaders():
+        print("%s\t%s\t%s\t%.2f" % (metric, analysis.describe(leader), analysis.describe(follower), correlation))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import datetime
+import os
+import shlex
+import sys
+from collections import OrderedDict
+from data.QualityScore import QualityScore, calculate_quality_score
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class ParsedDay(object):
+    """A daily CSV read through QualityScore, with each row's score worked out and the rows indexed by hour"""
+
+    def __init__(self, csv_data_file: str):
+        self.data = QualityScore(csv_data_file)
+        self.data.read_data()
+
+        self.scores = [calculate_quality_score(ave_rtt, bandwidth, packet_loss, pdv)
+                       for ave_rtt, bandwidth, packet_loss, pdv
+                       in zip(self.data.ave_RTT, self.data.bandwidth, self.data.packet_loss, self.data.pdv)]
+
+        self.hour_rows = {}
+        self.ip_rows = {}
+        for i, (timestamp, ip_address) in enumerate(zip(self.data.timestamp, self.data.ip_address)):
+            self.hour_rows.setdefault(int(timestamp[11:13]), []).append(i)
+            self.ip_rows.setdefault(ip_address, []).append(i)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def rows(self, hours=None, device=None) -> list:
+        """Indexes of the rows in the given hours of the day, for the given device id or IP address"""
+        if hours is None:
+            rows = range(len(self.scores))
+        else:
+            rows = sorted(i for hour in hours for i in self.hour_rows.get(hour, []))
+
+        if device is not None:
+            if isinstance(device, int):
+                device_rows = set(self.data.device_rows.get(device, []))
+            else:
+                device_rows = set(self.ip_rows.get(device, []))
+            rows = [i for i in rows if i in device_rows]
+
+        return list(rows)
+
+
+class DayCache(object):
+    """Least-recently-used cache of ParsedDay objects, bounded by the total number of rows held.
+
+    An entry is reparsed when its file's modification time changes, which is how today's file, still being
+    appended to, stays current.
+    """
+
+    def __init__(self, max_rows: int = 500000):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.days = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, csv_data_file: str):
+        """The parsed day for a file, or None if there is no such file"""
+        try:
+            mtime = os.stat(csv_data_file).st_mtime
+        except FileNotFoundError:
+            self._discard(csv_data_file)
+            return None
+
+        cached = self.days.get(csv_data_file)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            self.days.move_to_end(csv_data_file)
+            return cached[1]
+
+        self.misses += 1
+        self._discard(csv_data_file)
+        day = ParsedDay(csv_data_file)
+        self.days[csv_data_file] = (mtime, day)
+        self.rows += len(day)
+
+        # Always keep the day just parsed, even if it alone is over the limit
+        while self.rows > self.max_rows and len(self.days) > 1:
+            self._discard(next(iter(self.days)))
+
+        return day
+
+    def _discard(self, csv_data_file: str):
+        cached = self.days.pop(csv_data_file, None)
+        if cached is not None:
+            self.rows -= len(cached[1])
+
+
+class QualityQuery(object):
+    """Answers quality score queries across the archive of daily CSVs"""
+
+    def __init__(self, data_directory: str = DATA_DIRECTORY, cache: DayCache = None):
+        self.data_directory = data_directory
+        self.cache = cache if cache is not None else DayCache()
+
+    def day(self, date: datetime.date):
+        return self.cache.get(os.path.join(self.data_directory, str(date) + '.csv'))
+
+    def query(self, start: datetime.date, end: datetime.date, hours=None, device=None, by_hour=False) -> list:
+        """Mean quality score of each day (or each hour of each day) from start to end inclusive.
+
+        Args:
+            start: First day of the range.
+            end: Last day of the range.
+            hours: Only include these hours of the day, e.g. range(18, 22) for 18:00 to 21:59.
+            device: Only include this device, by registry device id (int) or IP address (str).
+            by_hour: Give a score per hour rather than per day.
+        Returns:
+            A list of (date, hour, score, samples) tuples, with hour None when scoring whole days. Days
+            and hours without measurements are left out.
+        """
+        results = []
+        date = start
+        while date <= end:
+            day = self.day(date)
+            if day is not None:
+                rows = day.rows(hours, device)
+                if by_hour:
+                    hourly = OrderedDict()
+                    for i in rows:
+                        hourly.setdefault(int(day.data.timestamp[i][11:13]), []).append(day.scores[i])
+                    for hour, scores in sorted(hourly.items()):
+                        results.append((date, hour, sum(scores) / len(scores), len(scores)))
+                elif rows:
+                    scores = [day.scores[i] for i in rows]
+                    results.append((date, None, sum(scores) / len(scores), len(scores)))
+            date += datetime.timedelta(days=1)
+        return results
+
+
+def parse_date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_hours(value: str) -> range:
+    """'18-22' is 18:00 up to 22:00, '18' is just the 18:00 hour"""
+    try:
+        if '-' in value:
+            first, last = (int(hour) for hour in value.split('-'))
+        else:
+            first = int(value)
+            last = first + 1
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r is not an hour or a range of hours such as 18-22" % value)
+
+    if not 0 <= first < last <= 24:
+        raise argparse.ArgumentTypeError("%r is not within 0-24 with the first hour before the last" % value)
+    return range(first, last)
+
+
+def parse_device(value: str):
+    return int(value) if value.isdigit() else value
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Query quality scores across the daily measurement files')
+    parser.add_argument('--from', dest='start', type=parse_date, default=None,
+                        help='First day, YYYY-MM-DD (default: 7 days before --to)')
+    parser.add_argument('--to', dest='end', type=parse_date, default=None,
+                        help='Last day, YYYY-MM-DD (default: today)')
+    parser.add_argument('--hours', type=parse_hours, default=None,
+                        help='Hours of the day to include, e.g. 18-22')
+    parser.add_argument('--device', type=parse_device, default=None,
+                        help='Device id from the device registry, or IP address')
+    parser.add_argument('--by-hour', dest='by_hour', action='store_true',
+                        help='Score each hour separately rather than each day')
+    return parser
+
+
+def run_query(quality_query: QualityQuery, args):
+    end = args.end if args.end is not None else datetime.date.today()
+    start = args.start if args.start is not None else end - datetime.timedelta(days=7)
+
+    print("Date\tHour\tQuality Score\tSamples")
+    for date, hour, score, samples in quality_query.query(start, end, args.hours, args.device, args.by_hour):
+        print("%s\t%s\t%f\t%d" % (date, "" if hour is None else "%02d:00" % hour, score, samples))
+
+
+def main():
+    parser = build_parser()
+    parser.add_argument('--stdin', action='store_true',
+                        help='Read one query per line from stdin, answering repeated queries from memory')
+    parser.add_argument('--cache-rows', dest='cache_rows', type=int, default=500000,
+                        help='Most measurement rows to keep parsed in memory')
+    args = parser.parse_args()
+
+    quality_query = QualityQuery(cache=DayCache(args.cache_rows))
+
+    if not args.stdin:
+        run_query(quality_query, args)
+        return
+
+    line_parser = build_parser()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            run_query(quality_query, line_parser.parse_args(shlex.split(line)))
+        except SystemExit:
+            # argparse has already reported the bad query; carry on with the next one
+            pass
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,11 @@ import datetime
 import sys
 
 
+def calculate_quality_score(ave_rtt: float, bandwidth: float, packet_loss: float, jitter: float) -> float:
+    """Quality score of a single measurement row. The hourly score is the mean of these over the hour."""
+    return (float(ave_rtt) / 2) + (float(bandwidth) * 1000) + float(packet_loss) + (float(jitter) * 100)
+
+
 class QualityScore(object):
     def __init__(self, csv_data_file: str):
         self.csv_data_file = csv_data_file
@@ -14,6 +19,8 @@ class QualityScore(object):
         self.max_RTT = []
         self.bandwidth = []
         self.pdv = []
+        self.device_id = []
+        self.device_rows = {}
         self.raw_quality_score = []
         self.quality_score = tuple()
 
@@ -31,6 +38,13 @@ class QualityScore(object):
                 self.bandwidth.append(row['Bandwidth'])
                 self.pdv.append(row['Packet Delay Variation'])
 
+                # Files written before the device registry existed have no Device ID column
+                device_id = row.get('Device ID')
+                device_id = int(device_id) if device_id else None
+                self.device_id.append(device_id)
+                if device_id is not None:
+                    self.device_rows.setdefault(device_id, []).append(len(self.device_id) - 1)
+
     def generate_score(self):
 
         def get_start_hour(time: list) -> tuple:
@@ -49,8 +63,7 @@ class QualityScore(object):
             #     data[0]: 00:00 --> 00:59.  data[1]: 01:00 --> 01:59
             qs = []
             for hourly_data in data:
-                quality_score = (float(hourly_data[0]) / 2) + (float(hourly_data[1]) * 1000) + \
-                                (float(hourly_data[2])) + (float(hourly_data[3]) * 100)
+                quality_score = calculate_quality_score(hourly_data[0], hourly_data[1], hourly_data[2], hourly_data[3])
                 qs.append(quality_score)
             self.raw_quality_score.append(sum(qs) / len(qs))
 
@@ -2,23 +2,64 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from Ping import Ping
-from ARPScan import ARPScan
+import time
 
+# Start-up is measured from here rather than from interpreter launch, which we have no control over
+startup_timer = time.perf_counter
+startup_start = startup_timer()
 
-def ping(hostname,
-         count=3,
-         timeout=3000,
-         packet_size=64,
-         own_id=None,
-         quiet=False,
-         silent=False,
-         ipv6=False):
+STARTUP_BUDGET = 500  # Time allowed (ms) between main.py starting and the first echo request
 
-    p = Ping(hostname, timeout, packet_size, own_id, quiet, silent, ipv6)
-    stats = p.run(count)
+import_costs = []
+first_echo_time = None
 
-    return not stats.packets_received
+
+def timed_import(module_name):
+    """Imports a module on first use, recording how long it took for --profile-startup"""
+    import importlib
+
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    start_time = startup_timer()
+    module = importlib.import_module(module_name)
+    import_costs.append((module_name, (startup_timer() - start_time) * 1000.0))
+    return module
+
+
+def startup_time(discovery_time: float = 0.0) -> float:
+    """Time (ms) from main.py starting to the first echo request, or until now if none has been sent.
+    Time spent waiting for devices to answer the network scans is not start-up cost, so it can be left out.
+    """
+    end_time = first_echo_time if first_echo_time is not None else startup_timer()
+    return (end_time - startup_start) * 1000.0 - discovery_time
+
+
+def report_startup(discovery_time: float):
+    sys.stderr.write("Startup profile (budget %d ms)\n" % STARTUP_BUDGET)
+    for module_name, cost in import_costs:
+        sys.stderr.write("  import %-24s %8.1f ms\n" % (module_name, cost))
+    if discovery_time:
+        sys.stderr.write("  %-31s %8.1f ms (not counted)\n" % ("network discovery", discovery_time))
+    if first_echo_time is None:
+        sys.stderr.write("  %-31s no echo sent\n" % "first echo request")
+    else:
+        sys.stderr.write("  %-31s %8.1f ms\n" % ("first echo request", startup_time(discovery_time)))
+
+
+def probe(hosts, args):
+    """Pings each (hostname, ipv6) host in turn, yielding a measurement record as each one finishes"""
+    global first_echo_time
+
+    Ping = timed_import("Ping").Ping
+    for hostname, ipv6 in hosts:
+        p = Ping(hostname, args.timeout, args.packetsize, None, args.quiet, False, ipv6)
+
+        if first_echo_time is None:
+            first_echo_time = startup_timer()
+
+        p.run(args.count)
+        yield p.measurement()
 
 
 def usage():
@@ -31,7 +72,7 @@ def main(arguments):
     # OptionParser is still present in current versions, but it is deprecated
     try:
 
-        import argparse
+        argparse = timed_import("argparse")
         parser = argparse.ArgumentParser(description='Perform network analysis on LAN')
 
         parser.add_argument('destination', type=str, nargs='?', help='destination')
@@ -43,6 +84,10 @@ def main(arguments):
         parser.add_argument('--ipv6',
                             action="store_true",
                             help='Run using IPv6, instead of the default (IPv4)')
+        parser.add_argument('--dual-stack',
+                            dest='dual_stack',
+                            action="store_true",
+                            help='Discover and measure devices over both IPv4 and IPv6 in each sweep')
         parser.add_argument('-c',
                             dest='count',
                             metavar='count',
@@ -63,6 +108,36 @@ def main(arguments):
                             type=int,
                             default=3,
                             help='Time to wait for a response, in seconds.')
+        parser.add_argument('--metrics-port',
+                            dest='metrics_port',
+                            metavar='port',
+                            type=int,
+                            default=None,
+                            help='Serve sweep metrics on http://127.0.0.1:<port>/metrics (Prometheus) '
+                                 'and /summary (JSON).')
+        parser.add_argument('--metrics-json',
+                            dest='metrics_json',
+                            metavar='file',
+                            type=str,
+                            default=None,
+                            help='Append a JSON summary of each sweep to this file '
+                                 '("-" for stdout, or stderr with --jsonl).')
+        parser.add_argument('--jsonl',
+                            action="store_true",
+                            help='Also write each measurement to stdout as a line of JSON, '
+                                 'moving all other output to stderr.')
+        parser.add_argument('--profile-startup',
+                            dest='profile_startup',
+                            action="store_true",
+                            help='Report the cost of each import and the time to the first echo request. '
+                                 'Exits non-zero if the start-up budget is exceeded.')
+        parser.add_argument('--interval',
+                            dest='interval',
+                            metavar='seconds',
+                            type=int,
+                            default=None,
+                            help='Keep running, starting a new sweep every interval seconds, and keep a rolling '
+                                 '1-hour quality score in memory.')
 
         args = parser.parse_args()
 
@@ -81,6 +156,8 @@ def main(arguments):
         parser.add_option('--ipv6',
                           action="store_true",
                           help='Run using IPv6, instead of the default (IPv4)')
+        parser.add_option('--dual-stack', dest='dual_stack', action="store_true",
+                          help='Discover and measure devices over both IPv4 and IPv6 in each sweep')
         parser.add_option('-c',
                           dest='count',
                           metavar='count',
@@ -101,6 +178,18 @@ def main(arguments):
                           type=int,
                           default=3,
                           help='Time to wait for a response, in seconds.')
+        parser.add_option('--metrics-port', dest='metrics_port', metavar='port', type=int, default=None,
+                          help='Serve sweep metrics on http://127.0.0.1:<port>/metrics')
+        parser.add_option('--metrics-json', dest='metrics_json', metavar='file', type=str, default=None,
+                          help='Append a JSON summary of each sweep to this file '
+                               '("-" for stdout, or stderr with --jsonl).')
+        parser.add_option('--jsonl', action="store_true",
+                          help='Also write each measurement to stdout as a line of JSON, '
+                               'moving all other output to stderr.')
+        parser.add_option('--profile-startup', dest='profile_startup', action="store_true",
+                          help='Report the cost of each import and the time to the first echo request.')
+        parser.add_option('--interval', dest='interval', metavar='seconds', type=int, default=None,
+                          help='Keep running, starting a new sweep every interval seconds.')
 
         (args, positional_args) = parser.parse_args()
 
@@ -108,21 +197,125 @@ def main(arguments):
         if positional_args:
             args.destination = positional_args[0]
 
-    if not args.destination:
-        args.destination = "192.168.0.1"
-
     # Convert timeout from sec to ms
     args.timeout *= 1000
 
-    # connected_devices = []
-    scan = ARPScan()
-    connected_devices = scan.scan()
+    # With --jsonl, stdout carries nothing but the JSON lines; everything meant for people goes to stderr
+    jsonl_stream = None
+    if args.jsonl:
+        jsonl_stream = sys.stdout
+        sys.stdout = sys.stderr
+
+    sweep_metrics = timed_import("SweepMetrics").sweep_metrics
+
+    # The rolling score is only meaningful for a process that outlives a single sweep
+    quality_window = timed_import("QualityWindow").QualityWindow() if args.interval else None
+
+    if args.metrics_port:
+        timed_import("SweepMetrics").serve_metrics(sweep_metrics, args.metrics_port, quality_window)
+
+    registry = timed_import("DeviceRegistry").DeviceRegistry().load()
+
+    # Cross-device analysis only makes sense for a full sweep of the network. The pipeline marks where each
+    # sweep ends, so the analysis is not left to guess it from devices being measured twice
+    contention = None
+    if not args.destination:
+        contention = timed_import("data.ContentionAnalysis").ContentionAnalysis(infer_sweeps=False).load()
+
+    Pipeline = timed_import("Pipeline")
+    sinks = [Pipeline.CsvSink()]
+    if args.jsonl:
+        sinks.append(Pipeline.JsonLinesSink(jsonl_stream))
+    if quality_window is not None:
+        sinks.append(Pipeline.QualityWindowSink(quality_window))
+    if contention is not None:
+        sinks.append(Pipeline.ContentionSink(contention))
+    pipeline = Pipeline.Pipeline(sinks)
+
+    try:
+        summary = sweep(args, sweep_metrics, registry, pipeline)
+        check_startup_budget(args.profile_startup, sweep_metrics)
+
+        while args.interval:
+            time.sleep(max(args.interval - summary["duration"], 0))
+            try:
+                summary = sweep(args, sweep_metrics, registry, pipeline)
+            except Exception:
+                # A transient failure (e.g. the interface dropping mid-scan) must not take the rolling score with it
+                error_type, error_value, etb = sys.exc_info()
+                sys.stderr.write("ERROR: sweep failed: %s\n" % error_value)
+                summary = {"duration": 0.0}
+    finally:
+        pipeline.close()
+
+
+def sweep(args, sweep_metrics, registry, pipeline) -> dict:
+    """Measures every connected device (or just args.destination) once, returning the sweep's phase breakdown"""
+    sweep_metrics.start_sweep()
+
+    if args.destination:
+        # One-shot run against a single host, no need to scan the network (or load scapy)
+        connected_devices = [(args.destination, args.ipv6 or ':' in args.destination)]
+    else:
+        connected_devices = []
+        neighbours = []
+
+        if not args.ipv6 or args.dual_stack:
+            ARPScan = timed_import("ARPScan").ARPScan
+            timed_import("scapy.all")
+            scan = ARPScan()
+            for device_ip in scan.scan() or []:
+                neighbours.append((scan.mac_addresses[device_ip], device_ip))
+                connected_devices.append((device_ip, False))
+
+        if args.ipv6 or args.dual_stack:
+            scan = timed_import("NeighbourScan").NeighbourScan()
+            for device_ip in scan.scan():
+                if device_ip in scan.mac_addresses:
+                    neighbours.append((scan.mac_addresses[device_ip], device_ip))
+                connected_devices.append((device_ip, True))
+
+        # Only held once the scans are done, so an overlapping run waits for milliseconds rather than seconds
+        with registry.update():
+            for mac_address, device_ip in neighbours:
+                registry.observe(mac_address, device_ip)
+
+    Pipeline = timed_import("Pipeline")
+    records = probe(connected_devices, args)
+    records = Pipeline.filter_records(records, lambda record: record["IP Address"] != "0.0.0.0")  # Unknown hosts
+    records = Pipeline.enrich_device_ids(records, registry)
+    pipeline.run(records)
+
+    summary = sweep_metrics.end_sweep()
+    export_sweep_summary(sweep_metrics, args.metrics_json)
+    return summary
+
+
+def check_startup_budget(profile_startup, sweep_metrics):
+    discovery_time = (sweep_metrics.phase_totals["arp_scan"] + sweep_metrics.phase_totals["neighbour_scan"]) * 1000.0
+    if profile_startup:
+        report_startup(discovery_time)
+
+    # Nothing to hold to the budget if no device was found to send an echo request to
+    over_budget = first_echo_time is not None and startup_time(discovery_time) > STARTUP_BUDGET
+    if over_budget:
+        sys.stderr.write("WARNING: start-up took %.1f ms, over the %d ms budget\n"
+                         % (startup_time(discovery_time), STARTUP_BUDGET))
+        if profile_startup:
+            sys.exit(1)
+
+
+def export_sweep_summary(sweep_metrics, metrics_json):
+    """Writes the last sweep's phase breakdown as a single JSON line"""
+    if not metrics_json:
+        return
 
-    for device_ip in connected_devices:
-        return_value = ping(hostname=device_ip, count=args.count, timeout=args.timeout,
-                            packet_size=args.packetsize,
-                            own_id=None, quiet=args.quiet, ipv6=args.ipv6)
+    if metrics_json == "-":
+        sys.stdout.write(sweep_metrics.summary_json() + "\n")
+    else:
+        with open(metrics_json, "a") as summary_file:
+            summary_file.write(sweep_metrics.summary_json() + "\n")
 
-        # sys.exit(return_value)
 
-main(sys.argv)
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,3 +1,2 @@
 #!/bin/sh
-cd /home/tom/src/local-QoS
-sudo python3 main.py
+sudo python3 /home/tom/src/local-QoS/main.py
@@ -0,0 +1,167 @@
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.ContentionAnalysis import ContentionAnalysis, PairwiseMoments, SeriesCorrelation
+
+
+def pearson(xs: list, ys: list) -> float:
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    c = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    m2_x = sum((x - mean_x) ** 2 for x in xs)
+    m2_y = sum((y - mean_y) ** 2 for y in ys)
+    return c / math.sqrt(m2_x * m2_y)
+
+
+def row(ave_rtt: float, packet_loss: float = 0.0) -> dict:
+    return {'Ave RTT': ave_rtt, 'Packet Loss': packet_loss}
+
+
+class TestPairwiseMoments(unittest.TestCase):
+    def test_matches_direct_calculation(self):
+        xs = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0]
+        ys = [2.0, 7.0, 1.0, 8.0, 2.0, 8.0, 1.0, 8.0]
+        moments = PairwiseMoments()
+        moments.grow(2)
+        for x, y in zip(xs, ys):
+            moments.update({0: x}, {1: y})
+
+        mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+        covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / (len(xs) - 1)
+        self.assertEqual(moments.count(0, 1), len(xs))
+        self.assertAlmostEqual(moments.covariance(0, 1), covariance)
+        self.assertAlmostEqual(moments.correlation(0, 1), pearson(xs, ys))
+
+    def test_only_pairs_observed_together_are_updated(self):
+        moments = PairwiseMoments()
+        moments.grow(3)
+        moments.update({0: 1.0, 1: 2.0}, {0: 1.0, 1: 2.0})
+        moments.update({0: 2.0, 2: 3.0}, {0: 2.0, 2: 3.0})
+
+        self.assertEqual(moments.count(0, 0), 2)
+        self.assertEqual(moments.count(0, 1), 1)
+        self.assertEqual(moments.count(1, 2), 0)
+        self.assertIsNone(moments.correlation(0, 1))
+
+    def test_reset_clears_row_and_column(self):
+        moments = PairwiseMoments()
+        moments.grow(2)
+        for value in (1.0, 2.0, 3.0):
+            moments.update({0: value, 1: value}, {0: value, 1: value})
+        moments.reset(1)
+
+        self.assertEqual(moments.count(0, 0), 3)
+        self.assertEqual(moments.count(0, 1), 0)
+        self.assertEqual(moments.count(1, 0), 0)
+        self.assertEqual(moments.count(1, 1), 0)
+
+
+class TestSeriesCorrelation(unittest.TestCase):
+    def test_lagged_correlation_finds_leader(self):
+        # Device 1 repeats what device 0 did one sweep earlier
+        leader = [1.0, 5.0, 2.0, 8.0, 3.0, 7.0, 1.0, 9.0, 2.0, 6.0, 4.0, 8.0, 1.0, 5.0]
+        series = SeriesCorrelation(min_samples=4)
+        series.grow(2)
+        previous = 0.0
+        for value in leader:
+            series.update({0: value, 1: previous})
+            previous = value
+
+        pairs = series.leaders()
+        self.assertEqual((pairs[0][0], pairs[0][1]), (0, 1))
+        self.assertAlmostEqual(pairs[0][2], 1.0)
+
+    def test_spike_followed_by_spike_is_flagged(self):
+        series = SeriesCorrelation(min_samples=4)
+        series.grow(2)
+        previous = 0.0
+        for value in [1.0, 2.0, 1.0, 3.0, 1.0, 2.0, 1.0, 3.0, 2.0, 1.0]:
+            series.update({0: value, 1: previous})
+            previous = value
+
+        self.assertEqual(series.update({0: 50.0, 1: previous}), [])
+        flagged = series.update({0: 1.0, 1: 50.0})
+        self.assertEqual([(leader, follower) for leader, follower, correlation in flagged], [(0, 1)])
+
+    def test_release_forgets_slot(self):
+        series = SeriesCorrelation()
+        series.grow(2)
+        series.update({0: 1.0, 1: 2.0})
+        series.release(1)
+
+        self.assertEqual(series.n, [1, 0])
+        self.assertNotIn(1, series.previous)
+        self.assertEqual(series.same.count(0, 1), 0)
+
+
+class TestContentionAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.directory.name, 'contention.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_dual_stack_device_is_one_sweep(self):
+        analysis = ContentionAnalysis(self.state_file)
+        for i, (device, ip_address) in enumerate([(0, '10.0.0.1'), (1, '10.0.0.2'), (0, 'fd00::1'), (1, 'fd00::2')]):
+            analysis.add_row(device, ip_address, '2017-02-10 12:00:0%d' % i, row(1.0 + i))
+        analysis.flush()
+
+        self.assertEqual(analysis.sweeps, 1)
+        self.assertEqual(analysis.series['Ave RTT'].n, [1, 1, 1, 1])
+        self.assertEqual(analysis.devices, [(0, 'v4'), (1, 'v4'), (0, 'v6'), (1, 'v6')])
+
+    def test_sweeps_inferred_only_when_asked(self):
+        inferred = ContentionAnalysis(self.state_file)
+        explicit = ContentionAnalysis(self.state_file, infer_sweeps=False)
+        for analysis in (inferred, explicit):
+            analysis.add_row(0, '10.0.0.1', '2017-02-10 12:00:01', row(1.0))
+            analysis.add_row(0, '10.0.0.1', '2017-02-10 12:00:02', row(2.0))
+
+        self.assertEqual(inferred.sweeps, 1)
+        self.assertEqual(explicit.sweeps, 0)
+
+    def test_idle_slots_are_reused(self):
+        analysis = ContentionAnalysis(self.state_file, max_idle_sweeps=2)
+        for sweep in range(6):
+            analysis.add_row('A', '10.0.0.1', '2017-02-10 12:00:%02da' % sweep, row(1.0))
+            analysis.add_row('10.0.0.%d' % (10 + sweep), '10.0.0.%d' % (10 + sweep),
+                             '2017-02-10 12:00:%02db' % sweep, row(2.0))
+            analysis.flush()
+
+        self.assertLessEqual(len(analysis.devices), 5)
+        self.assertIn(('10.0.0.15', 'v4'), analysis.slots)
+        self.assertNotIn(('10.0.0.10', 'v4'), analysis.slots)
+
+    def test_state_round_trips(self):
+        analysis = ContentionAnalysis(self.state_file)
+        analysis.add_row(3, 'fd00::3', '2017-02-10 12:00:00', row(1.0))
+        analysis.flush()
+        analysis.save()
+
+        loaded = ContentionAnalysis(self.state_file).load()
+        self.assertEqual(loaded.slots, {(3, 'v6'): 0})
+        self.assertEqual(loaded.sweeps, 1)
+        self.assertEqual(loaded.add_row(3, 'fd00::3', '2017-02-10 12:00:00', row(1.0)), [])
+        self.assertEqual(loaded.sweep, {})
+
+    def test_update_merges_saved_sweeps(self):
+        first = ContentionAnalysis(self.state_file, infer_sweeps=False).load()
+        second = ContentionAnalysis(self.state_file, infer_sweeps=False).load()
+        for analysis, device, timestamp in ((first, 1, '2017-02-10 12:00:01'), (second, 2, '2017-02-10 12:00:02')):
+            analysis.add_row(device, '10.0.0.%d' % device, timestamp, row(1.0))
+            with analysis.update():
+                analysis.flush()
+
+        loaded = ContentionAnalysis(self.state_file).load()
+        self.assertEqual(loaded.sweeps, 2)
+        self.assertEqual(sorted(loaded.slots), [(1, 'v4'), (2, 'v4')])
+
+
+if __name__ == '__main__':
+    unittest.main()
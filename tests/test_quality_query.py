@@ -0,0 +1,97 @@
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.QualityQuery import DayCache, QualityQuery, parse_hours
+from data.QualityScore import calculate_quality_score
+
+HEADER = "IP Address,Timestamp,Packet Loss,Min RTT,Ave RTT,Max RTT,Bandwidth,Packet Delay Variation,Device ID"
+
+
+class TestQualityQuery(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_day(self, date: str, rows: list, mtime: float = None) -> str:
+        """Writes a daily CSV of (ip address, hh:mm, ave rtt, device id) rows"""
+        csv_data_file = os.path.join(self.directory.name, date + '.csv')
+        with open(csv_data_file, 'w') as file:
+            file.write(HEADER)
+            for ip_address, time, ave_rtt, device_id in rows:
+                file.write("\n%s,%s %s:00.000000,0.0,1.0,%s,1.0,0.0,0.0,%s"
+                           % (ip_address, date, time, ave_rtt, device_id))
+        if mtime is not None:
+            os.utime(csv_data_file, (mtime, mtime))
+        return csv_data_file
+
+    def test_cache_hits_until_file_changes(self):
+        csv_data_file = self.write_day('2017-02-10', [('10.0.0.1', '12:00', 10.0, 0)], mtime=1000.0)
+        cache = DayCache()
+        day = cache.get(csv_data_file)
+
+        self.assertIs(cache.get(csv_data_file), day)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.write_day('2017-02-10', [('10.0.0.1', '12:00', 10.0, 0), ('10.0.0.1', '12:05', 20.0, 0)], mtime=2000.0)
+        self.assertEqual(len(cache.get(csv_data_file)), 2)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.rows, 2)
+
+    def test_cache_evicts_least_recently_used(self):
+        first = self.write_day('2017-02-10', [('10.0.0.1', '12:00', 10.0, 0)] * 2)
+        second = self.write_day('2017-02-11', [('10.0.0.1', '12:00', 10.0, 0)] * 2)
+        third = self.write_day('2017-02-12', [('10.0.0.1', '12:00', 10.0, 0)] * 2)
+        cache = DayCache(max_rows=4)
+        cache.get(first)
+        cache.get(second)
+        cache.get(first)
+        cache.get(third)
+
+        self.assertEqual(list(cache.days), [first, third])
+        self.assertEqual(cache.rows, 4)
+
+    def test_cache_keeps_oversized_day(self):
+        csv_data_file = self.write_day('2017-02-10', [('10.0.0.1', '12:00', 10.0, 0)] * 3)
+        cache = DayCache(max_rows=1)
+        self.assertIsNotNone(cache.get(csv_data_file))
+        self.assertEqual(list(cache.days), [csv_data_file])
+
+    def test_missing_day_is_none(self):
+        self.assertIsNone(DayCache().get(os.path.join(self.directory.name, '2017-02-10.csv')))
+
+    def test_query_by_hour_and_device(self):
+        self.write_day('2017-02-10', [('10.0.0.1', '18:00', 10.0, 0), ('10.0.0.2', '18:30', 30.0, 1),
+                                      ('10.0.0.1', '19:00', 20.0, 0), ('10.0.0.1', '23:00', 90.0, 0)])
+        quality_query = QualityQuery(self.directory.name)
+        date = datetime.date(2017, 2, 10)
+
+        def score(ave_rtt: float) -> float:
+            return calculate_quality_score(ave_rtt, 0.0, 0.0, 0.0)
+
+        results = quality_query.query(date, date, hours=range(18, 22), device=0, by_hour=True)
+        self.assertEqual([(hour, samples) for result_date, hour, quality, samples in results], [(18, 1), (19, 1)])
+        self.assertAlmostEqual(results[1][2], score(20.0))
+
+        (result,) = quality_query.query(date, date + datetime.timedelta(days=1), hours=range(18, 22))
+        self.assertEqual(result[3], 3)
+        self.assertAlmostEqual(result[2], (score(10.0) + score(30.0) + score(20.0)) / 3)
+
+    def test_parse_hours(self):
+        self.assertEqual(parse_hours('18-22'), range(18, 22))
+        self.assertEqual(parse_hours('23'), range(23, 24))
+        self.assertEqual(parse_hours('0-24'), range(0, 24))
+        for value in ('22-18', '18-18', '24', '-5', '0-25', 'evening'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_hours(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
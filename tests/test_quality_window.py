@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from QualityWindow import QualityWindow
+from data.QualityScore import calculate_quality_score
+
+
+def score(ave_rtt: float) -> float:
+    return calculate_quality_score(ave_rtt, 0.0, 0.0, 0.0)
+
+
+class TestQualityWindow(unittest.TestCase):
+    def test_empty_window_has_no_score(self):
+        window = QualityWindow()
+        self.assertIsNone(window.score(now=0.0))
+        self.assertIsNone(window.device_score('A', now=0.0))
+
+    def test_score_is_mean_of_samples(self):
+        window = QualityWindow()
+        window.add('A', 10.0, 0.0, 0.0, 0.0, timestamp=100.0)
+        window.add('B', 30.0, 0.0, 0.0, 0.0, timestamp=101.0)
+        window.add('A', 20.0, 0.0, 0.0, 0.0, timestamp=102.0)
+
+        self.assertAlmostEqual(window.score(now=102.0), (score(10.0) + score(30.0) + score(20.0)) / 3)
+        self.assertAlmostEqual(window.device_score('A', now=102.0), (score(10.0) + score(20.0)) / 2)
+        self.assertEqual(sorted(window.device_scores(now=102.0)), ['A', 'B'])
+
+    def test_samples_expire_after_window(self):
+        window = QualityWindow(window=60)
+        window.add('A', 10.0, 0.0, 0.0, 0.0, timestamp=0.0)
+        window.add('B', 30.0, 0.0, 0.0, 0.0, timestamp=50.0)
+
+        self.assertAlmostEqual(window.score(now=100.0), score(30.0))
+        self.assertIsNone(window.device_score('A', now=100.0))
+        self.assertNotIn('A', window.device_counts)
+        self.assertIsNone(window.score(now=200.0))
+        self.assertEqual(window.total, 0.0)
+
+    def test_full_buffer_drops_oldest(self):
+        window = QualityWindow(capacity=3)
+        for i, device in enumerate(['A', 'B', 'C', 'D', 'E']):
+            window.add(device, float(i), 0.0, 0.0, 0.0, timestamp=float(i))
+
+        self.assertEqual(window.size, 3)
+        self.assertEqual(sorted(window.device_scores(now=4.0)), ['C', 'D', 'E'])
+        self.assertAlmostEqual(window.score(now=4.0), (score(2.0) + score(3.0) + score(4.0)) / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
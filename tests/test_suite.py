@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    suite = unittest.defaultTestLoader.discover(TESTS_DIRECTORY, pattern='test_*.py',
+                                                top_level_dir=TESTS_DIRECTORY)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(not result.wasSuccessful())
+
+
+if __name__ == '__main__':
+    main()